@@ -15,8 +15,11 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import os
+import sqlite3
 import sys
 
 # Add project root to path
@@ -26,6 +29,15 @@ from src.database import Database, setup_database
 from src.agent import CloudWalkAgent
 from src.alerts import AnomalyDetector, AlertSeverity
 
+# Optional: LTTB downsampling for large time series
+try:
+    from plotly_resampler import FigureResampler
+except ImportError:
+    FigureResampler = None
+
+# Above this many points, downsample before shipping JSON to the browser
+RESAMPLE_THRESHOLD = 500
+
 
 # Page configuration
 st.set_page_config(
@@ -89,28 +101,75 @@ def init_detector(_db):
     return AnomalyDetector(db=_db)
 
 
+@st.cache_data(show_spinner=False)
+def _tpv_comparison(_db: Database, db_path: str, max_day: str) -> dict:
+    """Today vs D-1/D-7/D-30 TPV comparison (cached per data refresh).
+
+    Filters to the 4 target days in a single pass over transactions
+    instead of aggregating the full table once per comparison day.
+    """
+    latest = datetime.strptime(max_day, '%Y-%m-%d')
+    targets = {
+        'today_tpv': max_day,
+        'd1_tpv': (latest - timedelta(days=1)).strftime('%Y-%m-%d'),
+        'd7_tpv': (latest - timedelta(days=7)).strftime('%Y-%m-%d'),
+        'd30_tpv': (latest - timedelta(days=30)).strftime('%Y-%m-%d'),
+    }
+    df = _db.execute_small("""
+        SELECT day, tpv
+        FROM daily_tpv
+        WHERE day IN (?, ?, ?, ?)
+    """, tuple(targets.values()))
+    tpv_by_day = dict(zip(df['day'], df['tpv']))
+    return {label: tpv_by_day.get(day) for label, day in targets.items()}
+
+
+@st.cache_data(show_spinner=False)
+def _overall_stats(_db: Database, db_path: str, max_day: str) -> pd.DataFrame:
+    """Full-table TPV/transaction totals (cached per data refresh)."""
+    return _db.execute_small("""
+        SELECT
+            ROUND(SUM(amount_transacted), 2) as total_tpv,
+            SUM(quantity_transactions) as total_txns,
+            MIN(day) as start_date,
+            MAX(day) as end_date
+        FROM transactions
+    """)
+
+
+def maybe_resample(fig, n_points: int):
+    """
+    Wrap a time-series figure with LTTB resampling when it exceeds the
+    point threshold. Keeps Plotly responsive if finer-grained (e.g.
+    hourly) data is ever loaded; a no-op for the current daily series.
+    """
+    if FigureResampler is not None and n_points > RESAMPLE_THRESHOLD:
+        return FigureResampler(fig, default_n_shown_samples=RESAMPLE_THRESHOLD)
+    return fig
+
+
+# (threshold, divisor, suffix) tiers shared by the compact formatters
+_FORMAT_TIERS = (
+    (1_000_000_000, 1_000_000_000, 'B'),
+    (1_000_000, 1_000_000, 'M'),
+    (1_000, 1_000, 'K'),
+)
+
+
 def format_currency(value: float) -> str:
     """Format number as BRL currency."""
-    if value >= 1_000_000_000:
-        return f"R$ {value/1_000_000_000:.2f}B"
-    elif value >= 1_000_000:
-        return f"R$ {value/1_000_000:.2f}M"
-    elif value >= 1_000:
-        return f"R$ {value/1_000:.2f}K"
-    else:
-        return f"R$ {value:.2f}"
+    for threshold, divisor, suffix in _FORMAT_TIERS:
+        if value >= threshold:
+            return f"R$ {value/divisor:.2f}{suffix}"
+    return f"R$ {value:.2f}"
 
 
 def format_number(value: float) -> str:
     """Format large numbers with suffixes."""
-    if value >= 1_000_000_000:
-        return f"{value/1_000_000_000:.2f}B"
-    elif value >= 1_000_000:
-        return f"{value/1_000_000:.2f}M"
-    elif value >= 1_000:
-        return f"{value/1_000:.2f}K"
-    else:
-        return f"{value:.0f}"
+    for threshold, divisor, suffix in _FORMAT_TIERS:
+        if value >= threshold:
+            return f"{value/divisor:.2f}{suffix}"
+    return f"{value:.0f}"
 
 
 def render_sidebar(db: Database, detector: AnomalyDetector):
@@ -118,22 +177,14 @@ def render_sidebar(db: Database, detector: AnomalyDetector):
 
     st.sidebar.markdown("## 📊 Key Metrics")
 
+    # Cheap cache key: both cached queries are pure functions of the data,
+    # so they only need to be recomputed when new days arrive.
+    max_day = db.execute_small(
+        "SELECT MAX(day) as max_day FROM daily_tpv"
+    )['max_day'].iloc[0]
+
     # ===== D-1, D-7, D-30 Comparison =====
-    comparison_data = db.execute_query("""
-        WITH daily_tpv AS (
-            SELECT day, SUM(amount_transacted) as tpv
-            FROM transactions
-            GROUP BY day
-        ),
-        latest AS (
-            SELECT MAX(day) as max_day FROM transactions
-        )
-        SELECT
-            (SELECT tpv FROM daily_tpv WHERE day = (SELECT max_day FROM latest)) as today_tpv,
-            (SELECT tpv FROM daily_tpv WHERE day = date((SELECT max_day FROM latest), '-1 day')) as d1_tpv,
-            (SELECT tpv FROM daily_tpv WHERE day = date((SELECT max_day FROM latest), '-7 day')) as d7_tpv,
-            (SELECT tpv FROM daily_tpv WHERE day = date((SELECT max_day FROM latest), '-30 day')) as d30_tpv
-    """).iloc[0]
+    comparison_data = _tpv_comparison(db, str(db.db_path), max_day)
 
     today_tpv = comparison_data['today_tpv'] or 0
     d1_tpv = comparison_data['d1_tpv'] or today_tpv
@@ -160,14 +211,7 @@ def render_sidebar(db: Database, detector: AnomalyDetector):
     st.sidebar.markdown("---")
 
     # Get quick stats
-    stats = db.execute_query("""
-        SELECT
-            ROUND(SUM(amount_transacted), 2) as total_tpv,
-            SUM(quantity_transactions) as total_txns,
-            MIN(day) as start_date,
-            MAX(day) as end_date
-        FROM transactions
-    """).iloc[0]
+    stats = _overall_stats(db, str(db.db_path), max_day).iloc[0]
 
     total_tpv = stats['total_tpv']
     total_txns = stats['total_txns']
@@ -193,10 +237,11 @@ def render_sidebar(db: Database, detector: AnomalyDetector):
 
     alerts = detector.get_alerts_for_display()
 
-    # Summary counts
-    critical = sum(1 for a in alerts if a['severity'] == 'critical')
-    warning = sum(1 for a in alerts if a['severity'] == 'warning')
-    normal = sum(1 for a in alerts if a['severity'] == 'normal')
+    # Summary counts (single pass instead of one scan per severity)
+    counts = Counter(a['severity'] for a in alerts)
+    critical = counts.get('critical', 0)
+    warning = counts.get('warning', 0)
+    normal = counts.get('normal', 0)
 
     col1, col2, col3 = st.sidebar.columns(3)
     with col1:
@@ -235,15 +280,27 @@ def render_sidebar(db: Database, detector: AnomalyDetector):
         """, unsafe_allow_html=True)
 
 
+@st.cache_data(
+    show_spinner=False,
+    hash_funcs={pd.DataFrame: lambda d: (
+        tuple(d.columns),
+        pd.util.hash_pandas_object(d, index=False).values.tobytes()
+    )}
+)
 def auto_generate_chart(df: pd.DataFrame):
     """
     Automatically generate appropriate chart based on data structure.
+
+    Cached on a content hash of the DataFrame: chat reruns replay every
+    prior assistant message, and rebuilding identical Plotly figures each
+    time is wasted work.
     """
     if df is None or len(df) < 2:
         return None
 
     cols = df.columns.tolist()
-    numeric_cols = df.select_dtypes(include=['float64', 'int64', 'float', 'int']).columns.tolist()
+    # dtype.kind check avoids the DataFrame subset select_dtypes builds
+    numeric_cols = [c for c, dt in df.dtypes.items() if dt.kind in 'iuf']
 
     if len(numeric_cols) == 0:
         return None
@@ -254,13 +311,13 @@ def auto_generate_chart(df: pd.DataFrame):
     if 'day' in cols:
         fig = px.line(df, x='day', y=y_col, title=f'{y_col.replace("_", " ").title()} Over Time')
         fig.update_layout(xaxis_title='Date', yaxis_title=y_col.replace("_", " ").title())
-        return fig
+        return maybe_resample(fig, len(df))
 
     # Hourly data
     if 'hour' in cols:
         fig = px.bar(df, x='hour', y=y_col, title=f'{y_col.replace("_", " ").title()} by Hour')
         fig.update_layout(xaxis_title='Hour', yaxis_title=y_col.replace("_", " ").title())
-        return fig
+        return maybe_resample(fig, len(df))
 
     # Categorical: product, entity, payment_method, etc.
     categorical_cols = ['product', 'entity', 'payment_method', 'price_tier', 'anticipation_method']
@@ -282,8 +339,13 @@ def auto_generate_chart(df: pd.DataFrame):
     return None
 
 
+@st.fragment
 def render_chat(agent: CloudWalkAgent):
-    """Render chat interface."""
+    """Render chat interface.
+
+    Runs as a fragment: chat interactions rerun only this block instead
+    of the whole script (sidebar queries, anomaly checks, viz tabs).
+    """
 
     # Initialize chat history
     if "messages" not in st.session_state:
@@ -297,7 +359,7 @@ def render_chat(agent: CloudWalkAgent):
 
     # Display chat history in the container
     with chat_container:
-        for message in st.session_state.messages:
+        for i, message in enumerate(st.session_state.messages):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
 
@@ -306,16 +368,23 @@ def render_chat(agent: CloudWalkAgent):
                     with st.expander("📝 SQL Query"):
                         st.code(message["sql"], language="sql")
 
-                # Show data table if available
-                if message.get("data") and len(message["data"]) > 0:
-                    df = pd.DataFrame(message["data"])
+                # Show data table if available (stored as a DataFrame)
+                df = message.get("data")
+                if df is not None and len(df) > 0:
                     if len(df) <= 20:
                         st.dataframe(df, use_container_width=True)
 
-                    # Auto-generate chart
-                    fig = auto_generate_chart(df)
-                    if fig:
-                        st.plotly_chart(fig, use_container_width=True)
+                    # Auto-generate chart once per message, then reuse
+                    if "fig" not in message:
+                        message["fig"] = auto_generate_chart(df)
+                    if message["fig"]:
+                        # Stable key lets Streamlit reuse the frontend
+                        # component (Plotly.react) instead of rebuilding it
+                        st.plotly_chart(
+                            message["fig"],
+                            use_container_width=True,
+                            key=f"chat_fig_{i}"
+                        )
 
     # Process new input
     if prompt:
@@ -334,8 +403,27 @@ def render_chat(agent: CloudWalkAgent):
             "data": result.get("data")
         })
 
-        # Rerun to show updated messages
-        st.rerun()
+        # Rerun only the chat fragment to show updated messages
+        st.rerun(scope="fragment")
+
+
+def _run_parallel_queries(db_path: str, queries: dict) -> dict:
+    """
+    Run independent read-only queries concurrently, one connection per
+    worker (WAL mode supports concurrent readers). Wall-clock time
+    becomes ~max(query) instead of the serial sum.
+    """
+    def _run(sql: str) -> pd.DataFrame:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA query_only=1")
+            return pd.read_sql_query(sql, conn)
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        futures = {name: pool.submit(_run, sql) for name, sql in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
 
 
 def render_visualizations(db: Database):
@@ -343,15 +431,35 @@ def render_visualizations(db: Database):
 
     st.markdown("### 📈 Quick Visualizations")
 
+    # Fan out the three independent aggregations before rendering
+    frames = _run_parallel_queries(str(db.db_path), {
+        'daily': """
+            SELECT day, tpv
+            FROM daily_tpv
+            ORDER BY day
+        """,
+        'product': """
+            SELECT product, SUM(amount_transacted) as tpv
+            FROM transactions
+            GROUP BY product
+            ORDER BY tpv DESC
+        """,
+        'entity': """
+            SELECT
+                CASE entity
+                    WHEN 'PJ' THEN 'Business (PJ)'
+                    WHEN 'PF' THEN 'Individual (PF)'
+                END as entity_name,
+                SUM(amount_transacted) as tpv
+            FROM transactions
+            GROUP BY entity
+        """,
+    })
+
     tab1, tab2, tab3 = st.tabs(["Daily TPV", "By Product", "By Entity"])
 
     with tab1:
-        df = db.execute_query("""
-            SELECT day, SUM(amount_transacted) as tpv
-            FROM transactions
-            GROUP BY day
-            ORDER BY day
-        """)
+        df = frames['daily']
         fig = px.line(df, x='day', y='tpv', title='Daily TPV Trend')
         fig.update_traces(line_color='#2E86AB')
         fig.update_layout(
@@ -359,15 +467,10 @@ def render_visualizations(db: Database):
             yaxis_title='TPV (R$)',
             yaxis_tickformat=',.0f'
         )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(maybe_resample(fig, len(df)), use_container_width=True, key="viz_daily_tpv")
 
     with tab2:
-        df = db.execute_query("""
-            SELECT product, SUM(amount_transacted) as tpv
-            FROM transactions
-            GROUP BY product
-            ORDER BY tpv DESC
-        """)
+        df = frames['product']
         fig = px.bar(df, x='product', y='tpv', title='TPV by Product',
                      color='tpv', color_continuous_scale='Viridis')
         fig.update_layout(
@@ -376,23 +479,14 @@ def render_visualizations(db: Database):
             yaxis_tickformat=',.0f',
             showlegend=False
         )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True, key="viz_tpv_product")
 
     with tab3:
-        df = db.execute_query("""
-            SELECT
-                CASE entity
-                    WHEN 'PJ' THEN 'Business (PJ)'
-                    WHEN 'PF' THEN 'Individual (PF)'
-                END as entity_name,
-                SUM(amount_transacted) as tpv
-            FROM transactions
-            GROUP BY entity
-        """)
+        df = frames['entity']
         fig = px.pie(df, values='tpv', names='entity_name',
                      title='TPV Distribution by Entity',
                      color_discrete_sequence=['#2E86AB', '#A23B72'])
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True, key="viz_tpv_entity")
 
 
 def main():
@@ -411,19 +505,29 @@ def main():
     # Render sidebar
     render_sidebar(db, detector)
 
-    # Main content tabs
-    chat_tab, viz_tab, about_tab = st.tabs(["💬 Chat", "📊 Visualizations", "ℹ️ About"])
+    # Main content sections. st.tabs executes every tab body on each
+    # rerun, so the visualization queries would run on every chat turn;
+    # a radio-driven selector only renders (and queries for) the active
+    # section.
+    active_tab = st.radio(
+        "Section",
+        ["💬 Chat", "📊 Visualizations", "ℹ️ About"],
+        horizontal=True,
+        label_visibility="collapsed",
+        key="active_tab"
+    )
+    st.markdown("")
 
-    with chat_tab:
+    if active_tab == "💬 Chat":
         st.markdown("### Ask questions in natural language")
         st.markdown("Examples: *'What was the total TPV last week?'* | *'Which product has the highest revenue?'* | *'Compare PJ vs PF'*")
         st.markdown("")
         render_chat(agent)
 
-    with viz_tab:
+    elif active_tab == "📊 Visualizations":
         render_visualizations(db)
 
-    with about_tab:
+    else:
         st.markdown("""
         ### About This Project
 
@@ -0,0 +1,69 @@
+"""
+Numeric Kernels - CloudWalk Operations Intelligence
+
+Single-pass replacements for the pandas rolling statistics used by the
+anomaly checks. The checks only ever read the rolling mean/std at the
+second-to-last row, so computing the full rolling series is wasted work;
+these kernels walk just the final window with Welford's algorithm for a
+numerically stable mean/std.
+
+Kernels are JIT-compiled with Numba when it is installed and fall back
+to plain Python otherwise (the series are ~90 elements, so the fallback
+is still fast).
+
+Author: Gabriel Milhardo
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit when Numba is not installed."""
+        if args and callable(args[0]):
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True, fastmath=True)
+def last_two_rolling_mean_std(x, w):
+    """
+    Rolling mean/std of the window ending at the second-to-last element.
+
+    Equivalent to reading pandas' rolling(window=w).mean()/.std() at
+    iloc[-2], but in one Welford pass over the final w values instead of
+    materializing the whole rolling series.
+
+    Args:
+        x: 1-D float64 array, ordered by day
+        w: Window size
+
+    Returns:
+        Tuple of (prev_mean, prev_std, current). prev_mean/prev_std are
+        NaN when the series is shorter than w + 1 (matching pandas'
+        min_periods behavior).
+    """
+    n = x.shape[0]
+    current = x[n - 1]
+
+    if n - 1 < w:
+        return np.nan, np.nan, current
+
+    mean = 0.0
+    m2 = 0.0
+    count = 0
+    for i in range(n - 1 - w, n - 1):
+        count += 1
+        delta = x[i] - mean
+        mean += delta / count
+        m2 += delta * (x[i] - mean)
+
+    std = np.sqrt(m2 / (w - 1))
+    return mean, std, current
@@ -19,11 +19,14 @@ Author: Gabriel Milhardo
 
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from collections import Counter
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass
 from enum import Enum
 
 from src.database import Database
+from src._kernels import last_two_rolling_mean_std
 
 
 class AlertSeverity(Enum):
@@ -33,6 +36,27 @@ class AlertSeverity(Enum):
     CRITICAL = "critical"
 
 
+# Display sort order (critical first)
+_SEVERITY_ORDER = {
+    AlertSeverity.CRITICAL: 0,
+    AlertSeverity.WARNING: 1,
+    AlertSeverity.NORMAL: 2
+}
+
+# Display icon/color per severity, built once at import
+_ICONS = {
+    AlertSeverity.CRITICAL: "[!!!]",
+    AlertSeverity.WARNING: "[!]",
+    AlertSeverity.NORMAL: "[OK]"
+}
+
+_COLORS = {
+    AlertSeverity.CRITICAL: "red",
+    AlertSeverity.WARNING: "orange",
+    AlertSeverity.NORMAL: "green"
+}
+
+
 @dataclass
 class Alert:
     """
@@ -98,6 +122,12 @@ class AnomalyDetector:
         self.warning_threshold = warning_threshold
         self.critical_threshold = critical_threshold
 
+        # Memoized run_all_checks result; cleared via invalidate()
+        self._cache: Optional[Dict[str, Any]] = None
+
+        # Fused day x product aggregate shared by all checks
+        self._daily_frame: Optional[pd.DataFrame] = None
+
     def _calculate_z_score(
         self,
         current: float,
@@ -138,6 +168,43 @@ class AnomalyDetector:
         else:
             return AlertSeverity.NORMAL
 
+    def _insufficient_history_alert(
+        self,
+        metric: str,
+        dimension: str,
+        vals: np.ndarray
+    ) -> Alert:
+        """
+        Build the placeholder alert for series shorter than window + 1 days.
+
+        With no full window before the current day there is no baseline
+        to score against, so the checks early-exit here instead of
+        computing statistics over NaN.
+
+        Args:
+            metric: Name of the metric
+            dimension: Dimension being analyzed
+            vals: Daily series for the metric (may be empty)
+
+        Returns:
+            NORMAL Alert with z=0 and an explicit message
+        """
+        current = float(vals[-1]) if len(vals) else 0.0
+        return Alert(
+            metric=metric,
+            dimension=dimension,
+            current_value=current,
+            expected_value=current,
+            z_score=0.0,
+            severity=AlertSeverity.NORMAL,
+            change_pct=0.0,
+            message=(
+                f"{metric} ({dimension}): insufficient history for a "
+                f"{self.window}-day baseline "
+                f"({len(vals)} of {self.window + 1} days needed)"
+            )
+        )
+
     def _format_message(
         self,
         metric: str,
@@ -175,6 +242,40 @@ class AnomalyDetector:
             f"Current: R$ {current:,.2f}, Expected: R$ {expected:,.2f}"
         )
 
+    def _load_daily_frame(self) -> pd.DataFrame:
+        """
+        Load (and cache) the fused day x product daily aggregate.
+
+        All three checks derive from this one grouping, so a single scan
+        of transactions feeds the total-TPV, transaction-count, and
+        per-product checks. Cleared via invalidate().
+
+        Returns:
+            DataFrame with day, product, tpv, txns columns ordered by day
+        """
+        if self._daily_frame is None:
+            # Prefer the parquet-backed frame built at setup; fall back
+            # to aggregating through SQLite when it is absent. The
+            # fallback fetches columns as arrays and assembles the frame
+            # directly, skipping pd.read_sql_query's inference pass.
+            if self.db.daily_frame is not None:
+                self._daily_frame = self.db.daily_frame
+                return self._daily_frame
+            arrays = self.db.execute_query_arrays("""
+                SELECT
+                    day,
+                    product,
+                    SUM(amount_transacted) AS tpv,
+                    SUM(quantity_transactions) AS txns
+                FROM transactions
+                GROUP BY day, product
+                ORDER BY day
+            """)
+            arrays['tpv'] = arrays['tpv'].astype(np.float64, copy=False)
+            arrays['txns'] = arrays['txns'].astype(np.int64, copy=False)
+            self._daily_frame = pd.DataFrame(arrays)
+        return self._daily_frame
+
     def check_total_tpv(self) -> Alert:
         """
         Check total TPV for anomalies.
@@ -182,27 +283,11 @@ class AnomalyDetector:
         Returns:
             Alert object with analysis results
         """
-        # Get daily TPV
-        df = self.db.execute_query("""
-            SELECT day, SUM(amount_transacted) as tpv
-            FROM transactions
-            GROUP BY day
-            ORDER BY day
-        """)
-
-        df['day'] = pd.to_datetime(df['day'])
-        df = df.sort_values('day')
-
-        # Calculate rolling statistics
-        df['rolling_mean'] = df['tpv'].rolling(window=self.window).mean()
-        df['rolling_std'] = df['tpv'].rolling(window=self.window).std()
-
-        # Get latest values
-        latest = df.iloc[-1]
-        prev_mean = df.iloc[-2]['rolling_mean'] if len(df) > 1 else latest['rolling_mean']
-        prev_std = df.iloc[-2]['rolling_std'] if len(df) > 1 else latest['rolling_std']
-
-        current = latest['tpv']
+        df = self._load_daily_frame()
+        vals = df.groupby('day')['tpv'].sum().to_numpy(dtype=np.float64)
+        if len(vals) < self.window + 1:
+            return self._insufficient_history_alert("tpv", "total", vals)
+        prev_mean, prev_std, current = last_two_rolling_mean_std(vals, self.window)
         expected = prev_mean
 
         # Calculate Z-score
@@ -230,38 +315,55 @@ class AnomalyDetector:
         """
         alerts = []
 
-        # Get list of products
-        products = self.db.get_unique_values("product")
-
-        for product in products:
-            # Get daily TPV for this product
-            df = self.db.execute_query(f"""
-                SELECT day, SUM(amount_transacted) as tpv
-                FROM transactions
-                WHERE product = '{product}'
-                GROUP BY day
-                ORDER BY day
-            """)
-
-            df['day'] = pd.to_datetime(df['day'])
-            df = df.sort_values('day')
-
-            # Calculate rolling statistics
-            df['rolling_mean'] = df['tpv'].rolling(window=self.window).mean()
-            df['rolling_std'] = df['tpv'].rolling(window=self.window).std()
-
-            # Get latest values
-            latest = df.iloc[-1]
-            prev_mean = df.iloc[-2]['rolling_mean'] if len(df) > 1 else latest['rolling_mean']
-            prev_std = df.iloc[-2]['rolling_std'] if len(df) > 1 else latest['rolling_std']
-
-            current = latest['tpv']
-            expected = prev_mean
-
-            # Calculate Z-score
-            z_score = self._calculate_z_score(current, expected, prev_std)
-            severity = self._get_severity(z_score)
-            change_pct = ((current - expected) / expected) * 100 if expected else 0
+        # Wide day x product matrix from the shared daily frame. Days
+        # with no rows for a product are zero TPV, not missing: gaps in
+        # the window would turn the rolling stats NaN and force z to 0,
+        # so a product that stops transacting could never alert
+        pivot = self._load_daily_frame().pivot_table(
+            index='day', columns='product', values='tpv', aggfunc='sum',
+            fill_value=0
+        )
+        arr = pivot.to_numpy(dtype=np.float64)
+        n_days, n_products = arr.shape
+
+        if n_days < self.window + 1:
+            # Not enough days for a full window before the current one
+            # (possibly no days at all): skip the statistics entirely
+            return [
+                self._insufficient_history_alert("tpv", product, arr[:, idx])
+                for idx, product in enumerate(pivot.columns)
+            ]
+
+        current_arr = arr[-1]
+
+        # Strided view over the day axis: one reduction covers the
+        # trailing window of every product at once, no copies and no
+        # per-product loop for the statistics
+        windows = sliding_window_view(arr, self.window, axis=0)
+        prev_mean_arr = windows[-2].mean(axis=-1)
+        prev_std_arr = windows[-2].std(axis=-1, ddof=1)
+
+        # Classify every product in three ufunc passes instead of
+        # per-product calls to _calculate_z_score/_get_severity.
+        # NaN/zero std collapses to z=0, matching the scalar helper.
+        delta = current_arr - prev_mean_arr
+        z_arr = np.divide(delta, prev_std_arr,
+                          out=np.zeros(n_products),
+                          where=prev_std_arr > 0)
+        change_arr = np.divide(delta, prev_mean_arr,
+                               out=np.zeros(n_products),
+                               where=np.isfinite(prev_mean_arr)
+                               & (prev_mean_arr != 0)) * 100
+        abs_z = np.abs(z_arr)
+        sev_codes = ((abs_z >= self.warning_threshold).astype(np.int8)
+                     + (abs_z >= self.critical_threshold).astype(np.int8))
+        severities = (AlertSeverity.NORMAL, AlertSeverity.WARNING, AlertSeverity.CRITICAL)
+
+        for idx, product in enumerate(pivot.columns):
+            current = current_arr[idx]
+            expected = prev_mean_arr[idx]
+            z_score = float(z_arr[idx])
+            change_pct = float(change_arr[idx])
 
             alerts.append(Alert(
                 metric="tpv",
@@ -269,7 +371,7 @@ class AnomalyDetector:
                 current_value=current,
                 expected_value=expected,
                 z_score=z_score,
-                severity=severity,
+                severity=severities[sev_codes[idx]],
                 change_pct=change_pct,
                 message=self._format_message("tpv", product, z_score, change_pct, current, expected)
             ))
@@ -283,24 +385,11 @@ class AnomalyDetector:
         Returns:
             Alert object with analysis results
         """
-        df = self.db.execute_query("""
-            SELECT day, SUM(quantity_transactions) as txns
-            FROM transactions
-            GROUP BY day
-            ORDER BY day
-        """)
-
-        df['day'] = pd.to_datetime(df['day'])
-        df = df.sort_values('day')
-
-        df['rolling_mean'] = df['txns'].rolling(window=self.window).mean()
-        df['rolling_std'] = df['txns'].rolling(window=self.window).std()
-
-        latest = df.iloc[-1]
-        prev_mean = df.iloc[-2]['rolling_mean'] if len(df) > 1 else latest['rolling_mean']
-        prev_std = df.iloc[-2]['rolling_std'] if len(df) > 1 else latest['rolling_std']
-
-        current = latest['txns']
+        df = self._load_daily_frame()
+        vals = df.groupby('day')['txns'].sum().to_numpy(dtype=np.float64)
+        if len(vals) < self.window + 1:
+            return self._insufficient_history_alert("transactions", "total", vals)
+        prev_mean, prev_std, current = last_two_rolling_mean_std(vals, self.window)
         expected = prev_mean
 
         z_score = self._calculate_z_score(current, expected, prev_std)
@@ -324,37 +413,42 @@ class AnomalyDetector:
             message=message
         )
 
+    def invalidate(self) -> None:
+        """Clear the memoized check results (call after reloading data)."""
+        self._cache = None
+        self._daily_frame = None
+
     def run_all_checks(self) -> Dict[str, Any]:
         """
         Run all anomaly checks and return comprehensive results.
 
+        The result is memoized on the instance: the underlying data only
+        changes on reload, so dashboards that render alerts and summary
+        side-by-side don't pay for the full pipeline twice.
+
         Returns:
             Dictionary with all alerts and summary
         """
+        if self._cache is not None:
+            return self._cache
+
         results = {
             "total_tpv": self.check_total_tpv(),
             "transactions": self.check_transactions(),
             "by_product": self.check_tpv_by_product(),
-            "summary": {
-                "total_alerts": 0,
-                "critical": 0,
-                "warning": 0,
-                "normal": 0
-            }
         }
 
-        # Count alerts by severity
+        # Count alerts by severity in a single pass
         all_alerts = [results["total_tpv"], results["transactions"]] + results["by_product"]
+        counts = Counter(alert.severity for alert in all_alerts)
+        results["summary"] = {
+            "total_alerts": len(all_alerts),
+            "critical": counts[AlertSeverity.CRITICAL],
+            "warning": counts[AlertSeverity.WARNING],
+            "normal": counts[AlertSeverity.NORMAL]
+        }
 
-        for alert in all_alerts:
-            results["summary"]["total_alerts"] += 1
-            if alert.severity == AlertSeverity.CRITICAL:
-                results["summary"]["critical"] += 1
-            elif alert.severity == AlertSeverity.WARNING:
-                results["summary"]["warning"] += 1
-            else:
-                results["summary"]["normal"] += 1
-
+        self._cache = results
         return results
 
     def get_alerts_for_display(self) -> List[Dict[str, Any]]:
@@ -367,8 +461,18 @@ class AnomalyDetector:
         results = self.run_all_checks()
         all_alerts = [results["total_tpv"], results["transactions"]] + results["by_product"]
 
+        # Sort by severity (critical first): one stable argsort over an
+        # int8 code array instead of a Python key function per element
+        severity_codes = np.fromiter(
+            (_SEVERITY_ORDER[alert.severity] for alert in all_alerts),
+            dtype=np.int8,
+            count=len(all_alerts)
+        )
+        order = np.argsort(severity_codes, kind='stable')
+
         display_alerts = []
-        for alert in all_alerts:
+        for i in order:
+            alert = all_alerts[i]
             display_alerts.append({
                 "metric": alert.metric,
                 "dimension": alert.dimension,
@@ -380,29 +484,15 @@ class AnomalyDetector:
                 "color": self._get_color(alert.severity)
             })
 
-        # Sort by severity (critical first)
-        severity_order = {"critical": 0, "warning": 1, "normal": 2}
-        display_alerts.sort(key=lambda x: severity_order[x["severity"]])
-
         return display_alerts
 
     def _get_icon(self, severity: AlertSeverity) -> str:
         """Get icon for severity level."""
-        icons = {
-            AlertSeverity.CRITICAL: "[!!!]",
-            AlertSeverity.WARNING: "[!]",
-            AlertSeverity.NORMAL: "[OK]"
-        }
-        return icons[severity]
+        return _ICONS[severity]
 
     def _get_color(self, severity: AlertSeverity) -> str:
         """Get color for severity level."""
-        colors = {
-            AlertSeverity.CRITICAL: "red",
-            AlertSeverity.WARNING: "orange",
-            AlertSeverity.NORMAL: "green"
-        }
-        return colors[severity]
+        return _COLORS[severity]
 
 
 # Convenience function
@@ -200,3 +200,8 @@ Focus on:
 3. Business implications if relevant
 
 Be concise and professional. Use BRL currency format (R$ X,XXX.XX) for monetary values."""
+
+
+# UTF-8 bytes of the system prompt, encoded once at import so per-request
+# code can reuse them instead of re-encoding the ~3KB literal each call
+SYSTEM_PROMPT_BYTES = SYSTEM_PROMPT.encode("utf-8")